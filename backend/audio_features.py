@@ -0,0 +1,69 @@
+# backend/audio_features.py - Compiled audio feature kernels for speaker detection
+import numpy as np
+from numba import njit
+
+# Framing used by the spectral/energy features
+N_FFT = 1024
+HOP_LENGTH = 512
+HANN_WINDOW = np.hanning(N_FFT + 1)[:-1].astype(np.float32)
+
+@njit(cache=True, fastmath=True)
+def yin_pitch(y, sr, fmin=75.0, fmax=400.0, threshold=0.1):
+    """
+    Estimate the fundamental frequency of a float32 signal with YIN
+    Returns: pitch in Hz, or 0.0 when the signal is unvoiced or no period fits in it
+    """
+    tau_min = max(1, int(sr / fmax))
+    tau_max = int(sr / fmin)
+    window = y.shape[0] - tau_max
+    if window <= 0 or tau_min >= tau_max:
+        return np.float32(0.0)
+
+    # Difference function d(tau) = sum((y[i] - y[i + tau])^2)
+    diff = np.zeros(tau_max + 1, dtype=np.float32)
+    for tau in range(1, tau_max + 1):
+        acc = np.float32(0.0)
+        for i in range(window):
+            delta = y[i] - y[i + tau]
+            acc += delta * delta
+        diff[tau] = acc
+
+    # Cumulative mean normalized difference
+    cmnd = np.ones(tau_max + 1, dtype=np.float32)
+    running = np.float32(0.0)
+    for tau in range(1, tau_max + 1):
+        running += diff[tau]
+        if running > 0:
+            cmnd[tau] = diff[tau] * tau / running
+
+    # First dip below the threshold, walked down to its local minimum
+    for tau in range(tau_min, tau_max + 1):
+        if cmnd[tau] < threshold:
+            best_tau = tau
+            while best_tau < tau_max and cmnd[best_tau + 1] < cmnd[best_tau]:
+                best_tau += 1
+            return np.float32(sr / best_tau)
+
+    # Nothing periodic enough (silence, noise) - unvoiced
+    return np.float32(0.0)
+
+def centroid_and_rms(y, sr, n_fft=N_FFT, hop=HOP_LENGTH):
+    """
+    Compute mean spectral centroid and mean frame RMS in one framing pass
+    Returns: (spectral_centroid_hz, rms)
+    """
+    if y.shape[0] < n_fft:
+        y = np.pad(y, (0, n_fft - y.shape[0]))
+
+    # Strided view over the signal - frames share memory with y
+    frames = np.lib.stride_tricks.sliding_window_view(y, n_fft)[::hop]
+    window = HANN_WINDOW if n_fft == N_FFT else np.hanning(n_fft + 1)[:-1].astype(np.float32)
+
+    magnitude = np.abs(np.fft.rfft(frames * window, axis=1))
+    freqs = np.fft.rfftfreq(n_fft, d=1.0 / sr)
+    total = magnitude.sum(axis=1)
+    centroid = np.divide(magnitude @ freqs, total, out=np.zeros_like(total), where=total > 0)
+
+    rms = np.sqrt(np.einsum('ij,ij->i', frames, frames) / n_fft)
+
+    return np.float32(centroid.mean()), np.float32(rms.mean())
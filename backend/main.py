@@ -1,15 +1,22 @@
 # backend/main.py - FastAPI server for SOAP Note App
-from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Body, HTTPException, WebSocket, WebSocketDisconnect, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 import sys
 import os
+import io
 import uuid
+import asyncio
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Optional
-import json
+from typing import List, Dict, Set, Optional
+from collections import defaultdict
+from contextlib import asynccontextmanager
+import orjson
 
 # Add shared models to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
@@ -17,22 +24,58 @@ from shared.models import ConversationMessage, ConversationSession, SOAPNote, AP
 
 # Import backend modules
 try:
-    from .voice_processor import VoiceProcessor
+    from .voice_processor import VoiceProcessor, init_worker, worker_ready, process_in_worker
     from .soap_generator import SOAPGenerator
 except ImportError:
     # Fallback for direct execution
-    from voice_processor import VoiceProcessor
+    from voice_processor import VoiceProcessor, init_worker, worker_ready, process_in_worker
     from soap_generator import SOAPGenerator
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Initialize processors
+voice_processor = VoiceProcessor()
+soap_generator = SOAPGenerator()
+
+# Dedicated processes for transcription and feature extraction (created at startup)
+AUDIO_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+# Whisper threads per worker, so the pool together uses each core once
+AUDIO_WORKER_THREADS = max(1, (os.cpu_count() or 2) // AUDIO_WORKERS)
+audio_pool: Optional[ProcessPoolExecutor] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and warm the audio worker pool, then close it and outbound HTTP connections on shutdown"""
+    global audio_pool
+    # spawn, not fork: the server process already runs threads
+    audio_pool = ProcessPoolExecutor(
+        max_workers=AUDIO_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(voice_processor.model_size, AUDIO_WORKER_THREADS)
+    )
+    try:
+        loop = asyncio.get_running_loop()
+        ready = await asyncio.gather(*(loop.run_in_executor(audio_pool, worker_ready) for _ in range(AUDIO_WORKERS)))
+        if all(ready):
+            logger.info(f"Audio worker pool ready ({AUDIO_WORKERS} workers)")
+        else:
+            logger.warning("Audio worker pool started, but warmup failed - requests will retry the model load")
+        
+        yield
+    finally:
+        audio_pool.shutdown(cancel_futures=True)
+        await soap_generator.aclose()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="SOAP Note App API",
     description="Real-time voice processing and SOAP note generation",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -44,16 +87,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize processors
-voice_processor = VoiceProcessor()
-soap_generator = SOAPGenerator()
+# Compress larger responses (conversation JSON); small ones skip the gzip cost
+app.add_middleware(GZipMiddleware, minimum_size=500)
 
 # In-memory storage (use database in production)
-active_sessions: Dict[str, ConversationSession] = {}
-completed_sessions: Dict[str, ConversationSession] = {}
+sessions: Dict[str, ConversationSession] = {}
+
+# WebSocket connections for real-time updates, keyed by session_id
+active_connections: Dict[str, Set[WebSocket]] = defaultdict(set)
+
+# Per-client send timeout (seconds) for WebSocket broadcasts
+BROADCAST_TIMEOUT = 1.0
+
+# Waiters for new conversation messages, keyed by session_id.
+# Each event is set (and replaced by the next waiter) whenever the session changes.
+message_events: Dict[str, asyncio.Event] = {}
+
+# Seconds between SSE keepalive comments on an idle stream
+SSE_KEEPALIVE_INTERVAL = 21
+
+# Longest a `since` conversation poll is held open waiting for new messages
+LONG_POLL_TIMEOUT = 25
 
-# WebSocket connections for real-time updates
-active_connections: List[WebSocket] = []
+# Strong references to fire-and-forget tasks so they aren't garbage collected
+background_tasks = set()
 
 class StartSessionRequest(BaseModel):
     session_name: Optional[str] = None
@@ -61,6 +118,16 @@ class StartSessionRequest(BaseModel):
 class StopSessionRequest(BaseModel):
     session_id: str
 
+class NewMessage(BaseModel):
+    speaker: str
+    text: str
+    timestamp: Optional[str] = None
+    confidence: Optional[float] = None
+
+class AddMessagesRequest(BaseModel):
+    session_id: str
+    messages: List[NewMessage]
+
 class GenerateSOAPRequest(BaseModel):
     session_id: str
     patient_name: Optional[str] = "Unknown Patient"
@@ -86,7 +153,7 @@ async def start_session(request: StartSessionRequest):
             status="active"
         )
         
-        active_sessions[session_id] = session
+        sessions[session_id] = session
         
         logger.info(f"Started new session: {session_id}")
         
@@ -106,16 +173,13 @@ async def stop_session(request: StopSessionRequest):
     try:
         session_id = request.session_id
         
-        if session_id not in active_sessions:
+        session = sessions.get(session_id)
+        if session is None or session.status != "active":
             raise HTTPException(status_code=404, detail="Session not found")
         
-        session = active_sessions[session_id]
         session.end_time = datetime.now()
         session.status = "completed"
-        
-        # Move to completed sessions
-        completed_sessions[session_id] = session
-        del active_sessions[session_id]
+        _notify_session_update(session_id)
         
         logger.info(f"Stopped session: {session_id}")
         
@@ -125,22 +189,34 @@ async def stop_session(request: StopSessionRequest):
             data={"session_id": session_id, "message_count": len(session.messages)}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to stop session: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/voice/process")
-async def process_voice(session_id: str, audio: UploadFile = File(...)):
+async def process_voice(session_id: str, audio: bytes = Body(..., media_type="audio/wav")):
     """Process voice audio and add to conversation"""
     try:
-        if session_id not in active_sessions:
+        session = sessions.get(session_id)
+        if session is None or session.status != "active":
             raise HTTPException(status_code=404, detail="Active session not found")
         
-        # Read audio data
-        audio_bytes = await audio.read()
+        # Decode the raw WAV body in memory (soundfile raises LibsndfileError, a RuntimeError)
+        try:
+            y, sample_rate = await asyncio.to_thread(voice_processor.decode_audio, io.BytesIO(audio))
+        except RuntimeError as e:
+            logger.error(f"Audio decoding error: {e}")
+            return APIResponse(
+                success=False,
+                message="No speech detected in audio",
+                data={"confidence": 0.0}
+            )
         
-        # Process audio
-        text, speaker, confidence = voice_processor.process_audio_chunk(audio_bytes)
+        # Process audio on the worker pool so heavy chunks don't stall this process
+        loop = asyncio.get_running_loop()
+        text, speaker, confidence = await loop.run_in_executor(audio_pool, process_in_worker, y, sample_rate)
         
         if not text.strip():
             return APIResponse(
@@ -149,20 +225,9 @@ async def process_voice(session_id: str, audio: UploadFile = File(...)):
                 data={"confidence": confidence}
             )
         
-        # Create conversation message
-        message = ConversationMessage(
-            speaker=speaker,
-            text=text,
-            timestamp=datetime.now().strftime("%H:%M:%S"),
-            confidence=confidence
-        )
-        
-        # Add to session
-        session = active_sessions[session_id]
-        session.messages.append(message)
-        
-        # Broadcast to connected clients
-        await broadcast_message(session_id, message)
+        # Add to session and notify listeners
+        message = _append_message(session, speaker, text, confidence=confidence)
+        _notify_session_update(session_id)
         
         logger.info(f"Processed voice: {speaker} - {text[:50]}...")
         
@@ -173,60 +238,145 @@ async def process_voice(session_id: str, audio: UploadFile = File(...)):
                 "speaker": speaker,
                 "text": text,
                 "confidence": confidence,
-                "timestamp": message.timestamp
+                "timestamp": message.timestamp,
+                "seq": message.seq,
+                "message": message.model_dump()
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Voice processing error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/add_to_conversation/bulk")
+async def add_messages(request: AddMessagesRequest):
+    """Append several text messages to a session in one request"""
+    try:
+        session = sessions.get(request.session_id)
+        if session is None or session.status != "active":
+            raise HTTPException(status_code=404, detail="Active session not found")
+        
+        for new_message in request.messages:
+            _append_message(
+                session,
+                new_message.speaker,
+                new_message.text,
+                timestamp=new_message.timestamp,
+                confidence=new_message.confidence
+            )
+        _notify_session_update(request.session_id)
+        
+        logger.info(f"Added {len(request.messages)} messages to session: {request.session_id}")
+        
+        return APIResponse(
+            success=True,
+            message="Messages added successfully",
+            data={"added": len(request.messages), "message_count": len(session.messages)}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to add messages: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/session/{session_id}/conversation")
-async def get_conversation(session_id: str):
-    """Get conversation messages for a session"""
+async def get_conversation(
+    session_id: str,
+    request: Request,
+    response: Response,
+    since: Optional[int] = Query(None, ge=0),
+    wait: float = Query(0, ge=0, le=LONG_POLL_TIMEOUT)
+):
+    """
+    Get conversation messages for a session
+    With `since`, only messages with seq > since are returned; a non-zero `wait`
+    holds the request up to that many seconds until such a message exists (long polling).
+    """
     try:
-        # Check active sessions first
-        if session_id in active_sessions:
-            session = active_sessions[session_id]
-        elif session_id in completed_sessions:
-            session = completed_sessions[session_id]
-        else:
+        session = sessions.get(session_id)
+        if session is None:
             raise HTTPException(status_code=404, detail="Session not found")
         
+        if since is not None:
+            if len(session.messages) <= since and session.status == "active" and wait > 0:
+                await _wait_for_session_update(session_id, wait)
+            # seq is 1-based and contiguous, so the delta is a plain slice
+            messages = session.messages[since:]
+        else:
+            messages = session.messages
+        
+        etag = f'W/"{session_id}-{len(session.messages)}-{session.status}-{since}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        
         return APIResponse(
             success=True,
             message="Conversation retrieved successfully",
             data={
                 "session_id": session_id,
                 "status": session.status,
-                "messages": [msg.model_dump() for msg in session.messages],
-                "message_count": len(session.messages)
+                "messages": [msg.model_dump() for msg in messages],
+                "message_count": len(session.messages),
+                "last_seq": len(session.messages)
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to get conversation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/session/{session_id}/stream")
+async def stream_conversation(session_id: str, since: int = Query(0, ge=0)):
+    """
+    Server-Sent Events stream of conversation messages for a session
+    Starts after the client's cursor `since`, so a reconnecting client only gets the delta
+    """
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    async def event_stream():
+        delivered = since
+        while True:
+            # Event id is the message seq so clients can skip ones they already have
+            while delivered < len(session.messages):
+                message = session.messages[delivered]
+                yield b"id: %d\ndata: %s\n\n" % (message.seq, orjson.dumps(message.model_dump(mode="json")))
+                delivered += 1
+            
+            if session.status != "active":
+                break
+            
+            if not await _wait_for_session_update(session_id, SSE_KEEPALIVE_INTERVAL):
+                yield b": keepalive\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
 @app.post("/soap/generate")
 async def generate_soap_note(request: GenerateSOAPRequest):
     """Generate SOAP note from conversation"""
     try:
         session_id = request.session_id
         
-        # Get session (check both active and completed)
-        if session_id in active_sessions:
-            session = active_sessions[session_id]
-        elif session_id in completed_sessions:
-            session = completed_sessions[session_id]
-        else:
+        session = sessions.get(session_id)
+        if session is None:
             raise HTTPException(status_code=404, detail="Session not found")
         
         if not session.messages:
             raise HTTPException(status_code=400, detail="No conversation to analyze")
         
         # Generate SOAP note
-        soap_note = soap_generator.generate_soap_note(
+        soap_note = await soap_generator.generate_soap_note(
             conversation=session.messages,
             patient_name=request.patient_name
         )
@@ -239,16 +389,32 @@ async def generate_soap_note(request: GenerateSOAPRequest):
             data=soap_note.model_dump()
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"SOAP generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/soap/cache/clear")
+async def clear_soap_cache():
+    """Clear cached SOAP generation results"""
+    cleared = soap_generator.clear_cache()
+    logger.info(f"Cleared {cleared} cached SOAP responses")
+    
+    return APIResponse(
+        success=True,
+        message="SOAP cache cleared",
+        data={"cleared": cleared}
+    )
+
 @app.get("/sessions/active")
 async def get_active_sessions():
     """Get list of active sessions"""
     try:
         sessions_data = []
-        for session_id, session in active_sessions.items():
+        for session_id, session in sessions.items():
+            if session.status != "active":
+                continue
             sessions_data.append({
                 "session_id": session_id,
                 "start_time": session.start_time.isoformat(),
@@ -271,34 +437,92 @@ async def get_active_sessions():
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """WebSocket endpoint for real-time conversation updates"""
     await websocket.accept()
-    active_connections.append(websocket)
+    active_connections[session_id].add(websocket)
     
     try:
         while True:
             # Keep connection alive
             await websocket.receive_text()
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
+        _drop_connection(session_id, websocket)
+
+def _append_message(session: ConversationSession, speaker: str, text: str,
+                    timestamp: Optional[str] = None, confidence: Optional[float] = None) -> ConversationMessage:
+    """Append a message with the next seq and broadcast it in the background"""
+    message = ConversationMessage(
+        speaker=speaker,
+        text=text,
+        timestamp=timestamp or datetime.now().strftime("%H:%M:%S"),
+        confidence=confidence,
+        seq=len(session.messages) + 1
+    )
+    session.messages.append(message)
+    
+    # Broadcast to connected clients without holding up the HTTP response
+    task = asyncio.create_task(broadcast_message(session.session_id, message))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    
+    return message
+
+def _notify_session_update(session_id: str):
+    """Wake everything waiting on new messages (or a status change) for a session"""
+    event = message_events.pop(session_id, None)
+    if event is not None:
+        event.set()
+
+async def _wait_for_session_update(session_id: str, timeout: float) -> bool:
+    """Wait until the session changes; False if the timeout expired first"""
+    event = message_events.get(session_id)
+    if event is None:
+        event = message_events[session_id] = asyncio.Event()
+    try:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+def _drop_connection(session_id: str, websocket: WebSocket):
+    """Forget a WebSocket, and its session entry once no listeners remain"""
+    connections = active_connections.get(session_id)
+    if connections is not None:
+        connections.discard(websocket)
+        if not connections:
+            del active_connections[session_id]
 
 async def broadcast_message(session_id: str, message: ConversationMessage):
-    """Broadcast new message to connected clients"""
-    if active_connections:
+    """Broadcast new message to clients listening on the session"""
+    connections = list(active_connections.get(session_id, ()))
+    if connections:
         message_data = {
             "session_id": session_id,
-            "message": message.model_dump()
+            "message": message.model_dump(mode="json")
         }
+        # Serialized once as UTF-8 and sent as binary frames (clients parse it as JSON)
+        payload = orjson.dumps(message_data)
         
-        # Remove disconnected connections
-        disconnected = []
-        for connection in active_connections:
-            try:
-                await connection.send_text(json.dumps(message_data))
-            except:
-                disconnected.append(connection)
+        # Send to every client concurrently; a slow client only delays itself
+        results = await asyncio.gather(
+            *(asyncio.wait_for(connection.send_bytes(payload), timeout=BROADCAST_TIMEOUT)
+              for connection in connections),
+            return_exceptions=True
+        )
         
-        for conn in disconnected:
-            active_connections.remove(conn)
+        # Remove disconnected (or stalled) connections
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                if not isinstance(result, (WebSocketDisconnect, RuntimeError)):
+                    # Stalled or errored mid-send - close it so the client sees the drop and reconnects
+                    await _close_connection(connection)
+                _drop_connection(session_id, connection)
+
+async def _close_connection(websocket: WebSocket):
+    """Best-effort close of a WebSocket that may already be broken"""
+    try:
+        await asyncio.wait_for(websocket.close(code=1011), timeout=BROADCAST_TIMEOUT)
+    except Exception:
+        pass
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8002, reload=True)
+    uvicorn.run(app, host="127.0.0.1", port=8002, loop="uvloop", http="httptools")
@@ -1,6 +1,10 @@
 # backend/soap_generator.py - SOAP note generation using AI
-from groq import Groq
+from groq import AsyncGroq
+import httpx
 import os
+import re
+import hashlib
+from collections import OrderedDict
 from typing import List, Dict, Optional
 from datetime import datetime
 import logging
@@ -15,19 +19,47 @@ logger = logging.getLogger(__name__)
 class SOAPGenerator:
     """Generates SOAP notes from doctor-patient conversations using AI"""
     
+    # Section headers in the model response, e.g. "SUBJECTIVE: ..."
+    _SOAP_RE = re.compile(r'^[ \t]*(SUBJECTIVE|OBJECTIVE|ASSESSMENT|PLAN):[ \t]*', re.M)
+    # Line breaks (and surrounding whitespace) inside a section body
+    _LINE_BREAK_RE = re.compile(r'\s*\n\s*')
+    # Keywords hinting at age and reason for visit (prefix match: "years", "painful", ...)
+    _PATIENT_RE = re.compile(r'\b(year|age|pain|problem|issue)', re.I)
+    
+    MODEL = "llama3-8b-8192"
+    # Bump whenever the prompts change so cached responses are not reused
+    PROMPT_VERSION = 1
+    # Maximum number of cached Groq responses
+    CACHE_SIZE = 512
+    
     def __init__(self, groq_api_key: str = None):
         """Initialize SOAP generator with Groq API"""
         # Use provided key or default (you should set this in environment)
         self.api_key = groq_api_key or ""
         
         try:
-            self.groq_client = Groq(api_key=self.api_key)
+            # One pooled keep-alive HTTP/2 client so SOAP calls reuse the TLS connection
+            self.http_client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20),
+                timeout=httpx.Timeout(60.0)
+            )
+            self.groq_client = AsyncGroq(api_key=self.api_key, http_client=self.http_client)
             logger.info("Groq client initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Groq client: {e}")
             self.groq_client = None
+            self.http_client = None
+        
+        # LRU cache of parsed SOAP sections keyed by conversation hash
+        self._sections_cache: "OrderedDict[bytes, Dict[str, str]]" = OrderedDict()
+    
+    async def aclose(self):
+        """Close the pooled HTTP client"""
+        if self.http_client is not None:
+            await self.http_client.aclose()
     
-    def generate_soap_note(self, conversation: List[ConversationMessage], 
+    async def generate_soap_note(self, conversation: List[ConversationMessage], 
                           patient_name: str = "Unknown Patient") -> SOAPNote:
         """
         Generate SOAP note from conversation messages
@@ -37,7 +69,7 @@ class SOAPGenerator:
             conversation_text = self._format_conversation(conversation)
             
             # Generate SOAP sections using AI
-            soap_sections = self._generate_soap_sections(conversation_text)
+            soap_sections = await self._generate_soap_sections(conversation_text)
             
             # Extract patient info from conversation
             patient_info = self._extract_patient_info(conversation_text)
@@ -65,21 +97,20 @@ class SOAPGenerator:
     
     def _format_conversation(self, conversation: List[ConversationMessage]) -> str:
         """Format conversation messages for AI processing"""
-        formatted_lines = []
-        
-        for msg in conversation:
-            timestamp = msg.timestamp
-            speaker = msg.speaker
-            text = msg.text
-            formatted_lines.append(f"[{timestamp}] {speaker}: {text}")
-        
-        return "\n".join(formatted_lines)
+        return "\n".join(f"[{msg.timestamp}] {msg.speaker}: {msg.text}" for msg in conversation)
     
-    def _generate_soap_sections(self, conversation_text: str) -> Dict[str, str]:
+    async def _generate_soap_sections(self, conversation_text: str) -> Dict[str, str]:
         """Generate SOAP sections using Groq AI"""
         if not self.groq_client:
             return self._create_fallback_soap_sections(conversation_text)
         
+        cache_key = self._cache_key(conversation_text)
+        cached = self._sections_cache.get(cache_key)
+        if cached is not None:
+            self._sections_cache.move_to_end(cache_key)
+            logger.info("SOAP sections served from cache")
+            return dict(cached)
+        
         try:
             # System prompt for SOAP note generation
             system_prompt = """You are an expert medical assistant that generates SOAP notes from doctor-patient conversations.
@@ -105,8 +136,8 @@ ASSESSMENT: [medical diagnosis/impression]
 PLAN: [treatment plan and recommendations]"""
 
             # Call Groq API
-            response = self.groq_client.chat.completions.create(
-                model="llama3-8b-8192",
+            response = await self.groq_client.chat.completions.create(
+                model=self.MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
@@ -117,12 +148,29 @@ PLAN: [treatment plan and recommendations]"""
             
             # Parse response
             soap_text = response.choices[0].message.content.strip()
-            return self._parse_soap_response(soap_text)
+            sections = self._parse_soap_response(soap_text)
+            
+            self._sections_cache[cache_key] = sections
+            if len(self._sections_cache) > self.CACHE_SIZE:
+                self._sections_cache.popitem(last=False)
+            
+            return dict(sections)
             
         except Exception as e:
             logger.error(f"Groq API error: {e}")
             return self._create_fallback_soap_sections(conversation_text)
     
+    def _cache_key(self, conversation_text: str) -> bytes:
+        """Hash conversation text together with the model and prompt version"""
+        key = f"{self.MODEL}:{self.PROMPT_VERSION}\n{conversation_text}"
+        return hashlib.blake2b(key.encode(), digest_size=16).digest()
+    
+    def clear_cache(self) -> int:
+        """Drop all cached SOAP sections, returning how many were removed"""
+        count = len(self._sections_cache)
+        self._sections_cache.clear()
+        return count
+    
     def _parse_soap_response(self, soap_text: str) -> Dict[str, str]:
         """Parse AI response into SOAP sections"""
         sections = {
@@ -134,25 +182,13 @@ PLAN: [treatment plan and recommendations]"""
         }
         
         try:
-            lines = soap_text.split('\n')
-            current_section = None
+            headers = list(self._SOAP_RE.finditer(soap_text))
             
-            for line in lines:
-                line = line.strip()
-                if line.startswith('SUBJECTIVE:'):
-                    current_section = 'subjective'
-                    sections[current_section] = line.replace('SUBJECTIVE:', '').strip()
-                elif line.startswith('OBJECTIVE:'):
-                    current_section = 'objective'
-                    sections[current_section] = line.replace('OBJECTIVE:', '').strip()
-                elif line.startswith('ASSESSMENT:'):
-                    current_section = 'assessment'
-                    sections[current_section] = line.replace('ASSESSMENT:', '').strip()
-                elif line.startswith('PLAN:'):
-                    current_section = 'plan'
-                    sections[current_section] = line.replace('PLAN:', '').strip()
-                elif current_section and line:
-                    sections[current_section] += ' ' + line
+            # Each section runs from the end of its header to the start of the next
+            for header, next_header in zip(headers, headers[1:] + [None]):
+                end = next_header.start() if next_header else len(soap_text)
+                body = soap_text[header.end():end].strip()
+                sections[header.group(1).lower()] = self._LINE_BREAK_RE.sub(' ', body)
             
             return sections
             
@@ -165,15 +201,15 @@ PLAN: [treatment plan and recommendations]"""
         info = {}
         
         # Simple extraction - in production, use NLP
-        lines = conversation_text.lower()
+        matches = {m.group(1).lower() for m in self._PATIENT_RE.finditer(conversation_text)}
         
         # Look for age mentions
-        if 'year' in lines or 'age' in lines:
+        if matches & {'year', 'age'}:
             # This is very basic - would need proper NLP
             info['age_gender'] = "Age/Gender mentioned in conversation"
         
         # Look for reason for visit
-        if 'pain' in lines or 'problem' in lines or 'issue' in lines:
+        if matches & {'pain', 'problem', 'issue'}:
             info['reason'] = "Medical concern discussed"
         
         return info
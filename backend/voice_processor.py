@@ -1,66 +1,89 @@
 # backend/voice_processor.py - Voice processing and speaker detection
-import speech_recognition as sr
+from faster_whisper import WhisperModel
 import numpy as np
-import librosa
 import soundfile as sf
-import tempfile
-import os
-from typing import Tuple, Optional
+import soxr
+from functools import lru_cache
+from typing import BinaryIO, Tuple, Optional
 import logging
 
+try:
+    from .audio_features import yin_pitch, centroid_and_rms
+except ImportError:
+    # Fallback for direct execution
+    from audio_features import yin_pitch, centroid_and_rms
+
 logger = logging.getLogger(__name__)
 
+# Whisper models are trained on 16 kHz mono audio; features are computed at the same rate
+WHISPER_SAMPLE_RATE = 16000
+
+@lru_cache(maxsize=None)
+def get_whisper_model(model_size: str = "small.en", cpu_threads: int = 0) -> WhisperModel:
+    """
+    Load the local Whisper model once per process (INT8 on CPU)
+    cpu_threads=0 lets CTranslate2 pick its default thread count
+    """
+    logger.info(f"Loading Whisper model: {model_size} ({cpu_threads or 'default'} threads)")
+    return WhisperModel(model_size, device="cpu", compute_type="int8", cpu_threads=cpu_threads)
+
 class VoiceProcessor:
     """Handles voice recording, transcription, and speaker detection"""
     
-    def __init__(self):
-        self.recognizer = sr.Recognizer()
-        self.microphone = sr.Microphone()
-        
-        # Calibrate microphone
-        try:
-            with self.microphone as source:
-                self.recognizer.adjust_for_ambient_noise(source, duration=1)
-            logger.info("Microphone calibrated successfully")
-        except Exception as e:
-            logger.error(f"Microphone calibration failed: {e}")
+    def __init__(self, model_size: str = "small.en", cpu_threads: int = 0):
+        # The model is loaded lazily (or by warmup) so importing stays cheap
+        self.model_size = model_size
+        self.cpu_threads = cpu_threads
+    
+    @property
+    def model(self) -> WhisperModel:
+        return get_whisper_model(self.model_size, self.cpu_threads)
+    
+    def warmup(self):
+        """Load the Whisper model and compile the feature kernels ahead of the first request"""
+        silence = np.zeros(WHISPER_SAMPLE_RATE, dtype=np.float32)
+        yin_pitch(silence[:2048], WHISPER_SAMPLE_RATE)
+        centroid_and_rms(silence, WHISPER_SAMPLE_RATE)
+        segments, _ = self.model.transcribe(silence, beam_size=1)
+        list(segments)
+        logger.info("Voice processor warmed up")
     
-    def transcribe_audio(self, audio_file_path: str) -> Tuple[str, float]:
+    def transcribe_audio(self, y: np.ndarray, sample_rate: int) -> Tuple[str, float]:
         """
-        Transcribe audio file to text
+        Transcribe mono float32 audio to text with the local Whisper model
         Returns: (transcribed_text, confidence_score)
         """
         try:
-            with sr.AudioFile(audio_file_path) as source:
-                audio_data = self.recognizer.record(source)
-                text = self.recognizer.recognize_google(audio_data, language='en-US')
-                
-                # Simple confidence estimation based on text length and clarity
-                confidence = min(0.95, len(text.split()) / 10.0 + 0.5)
-                
-                return text, confidence
+            if sample_rate != WHISPER_SAMPLE_RATE:
+                y = soxr.resample(y, sample_rate, WHISPER_SAMPLE_RATE)
+            
+            segments, info = self.model.transcribe(y, beam_size=1, vad_filter=True)
+            # Segments are decoded lazily - materialize them once
+            segments = list(segments)
+            text = " ".join(segment.text.strip() for segment in segments).strip()
+            
+            if not text:
+                logger.warning("Could not understand audio")
+                return "", 0.0
+            
+            # Confidence from the mean token log-probability of the decoded segments
+            avg_logprob = sum(segment.avg_logprob for segment in segments) / len(segments)
+            confidence = min(0.95, float(np.exp(avg_logprob)))
+            
+            return text, confidence
                 
-        except sr.UnknownValueError:
-            logger.warning("Could not understand audio")
-            return "", 0.0
-        except sr.RequestError as e:
-            logger.error(f"Speech recognition service error: {e}")
-            return "", 0.0
         except Exception as e:
             logger.error(f"Transcription error: {e}")
             return "", 0.0
     
-    def detect_speaker(self, audio_file_path: str) -> Tuple[str, float]:
+    def detect_speaker(self, y: np.ndarray, sample_rate: int) -> Tuple[str, float]:
         """
         Detect if speaker is doctor or patient based on audio characteristics
         Returns: (speaker_type, confidence)
         """
         try:
-            # Load audio file
-            y, sr_rate = librosa.load(audio_file_path, sr=None)
-            
             # Extract audio features
-            features = self._extract_audio_features(y, sr_rate)
+            features = self._extract_audio_features(y, sample_rate)
             
             # Simple rule-based speaker detection
             # This is a basic implementation - in production, you'd use ML models
@@ -76,26 +99,18 @@ class VoiceProcessor:
     def _extract_audio_features(self, audio_data: np.ndarray, sample_rate: int) -> dict:
         """Extract audio features for speaker classification"""
         try:
-            # Fundamental frequency (pitch)
-            pitches, magnitudes = librosa.piptrack(y=audio_data, sr=sample_rate)
-            pitch_mean = np.mean(pitches[pitches > 0]) if len(pitches[pitches > 0]) > 0 else 0
-            
-            # Spectral features
-            spectral_centroids = librosa.feature.spectral_centroid(y=audio_data, sr=sample_rate)[0]
-            spectral_mean = np.mean(spectral_centroids)
+            audio_data = np.ascontiguousarray(audio_data, dtype=np.float32)
             
-            # Energy/volume
-            rms = librosa.feature.rms(y=audio_data)[0]
-            energy_mean = np.mean(rms)
+            # Fundamental frequency (pitch)
+            pitch_mean = float(yin_pitch(audio_data, sample_rate))
             
-            # Speaking rate (rough estimation)
-            tempo, _ = librosa.beat.beat_track(y=audio_data, sr=sample_rate)
+            # Spectral centroid and energy/volume share one framing pass
+            spectral_mean, energy_mean = centroid_and_rms(audio_data, sample_rate)
             
             return {
                 'pitch_mean': pitch_mean,
                 'spectral_centroid': spectral_mean,
                 'energy': energy_mean,
-                'tempo': tempo,
                 'duration': len(audio_data) / sample_rate
             }
             
@@ -105,7 +120,6 @@ class VoiceProcessor:
                 'pitch_mean': 0,
                 'spectral_centroid': 0,
                 'energy': 0,
-                'tempo': 0,
                 'duration': 0
             }
     
@@ -150,36 +164,73 @@ class VoiceProcessor:
             logger.error(f"Speaker classification error: {e}")
             return "Patient", 0.5
     
-    def process_audio_chunk(self, audio_bytes: bytes) -> Tuple[str, str, float]:
+    def decode_audio(self, audio_file: BinaryIO) -> Tuple[np.ndarray, int]:
+        """
+        Decode a WAV file object straight into mono float32 samples at 16 kHz
+        Returns: (samples, sample_rate)
         """
-        Process audio chunk and return transcription with speaker detection
+        y, sample_rate = sf.read(audio_file, dtype='float32', always_2d=False)
+        if y.ndim > 1:
+            y = y.mean(axis=1)
+        
+        # Speech features and Whisper both only need the band below 8 kHz
+        if sample_rate != WHISPER_SAMPLE_RATE:
+            y = soxr.resample(y, sample_rate, WHISPER_SAMPLE_RATE, quality='HQ')
+            sample_rate = WHISPER_SAMPLE_RATE
+        return y, sample_rate
+    
+    def process_audio_chunk(self, y: np.ndarray, sample_rate: int) -> Tuple[str, str, float]:
+        """
+        Process decoded audio and return transcription with speaker detection
         Returns: (transcribed_text, speaker, confidence)
         """
         try:
-            # Save audio bytes to temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-                temp_file.write(audio_bytes)
-                temp_file_path = temp_file.name
-            
             # Transcribe audio
-            text, trans_confidence = self.transcribe_audio(temp_file_path)
+            text, trans_confidence = self.transcribe_audio(y, sample_rate)
             
             # Detect speaker
-            speaker, speaker_confidence = self.detect_speaker(temp_file_path)
+            speaker, speaker_confidence = self.detect_speaker(y, sample_rate)
             
             # Combined confidence
             combined_confidence = (trans_confidence + speaker_confidence) / 2
             
-            # Clean up
-            os.unlink(temp_file_path)
-            
             return text, speaker, combined_confidence
             
         except Exception as e:
             logger.error(f"Audio processing error: {e}")
-            if 'temp_file_path' in locals():
-                try:
-                    os.unlink(temp_file_path)
-                except:
-                    pass
             return "", "Patient", 0.0
+
+# Per-process VoiceProcessor used by the audio worker pool, and the settings it was built with
+_worker_processor: Optional[VoiceProcessor] = None
+_worker_model_size = "small.en"
+_worker_cpu_threads = 0
+
+def init_worker(model_size: str = "small.en", cpu_threads: int = 0):
+    """
+    Process pool initializer: build and warm this worker's VoiceProcessor
+    cpu_threads caps the worker's CTranslate2 thread pool so workers don't oversubscribe the cores
+    A failed load (e.g. no network or model cache) is logged, not raised - raising would break
+    the whole pool - and the first request retries it with the same settings
+    """
+    global _worker_processor, _worker_model_size, _worker_cpu_threads
+    _worker_model_size, _worker_cpu_threads = model_size, cpu_threads
+    processor = VoiceProcessor(model_size, cpu_threads)
+    try:
+        processor.warmup()
+    except Exception as e:
+        logger.error(f"Audio worker warmup failed: {e}")
+        return
+    _worker_processor = processor
+
+def worker_ready() -> bool:
+    """No-op task used to spawn (and so warm) pool workers ahead of time"""
+    return _worker_processor is not None
+
+def process_in_worker(y: np.ndarray, sample_rate: int) -> Tuple[str, str, float]:
+    """Pool entry point for VoiceProcessor.process_audio_chunk"""
+    if _worker_processor is None:
+        # Warmup failed at startup - retry the load with the configured settings
+        init_worker(_worker_model_size, _worker_cpu_threads)
+        if _worker_processor is None:
+            raise RuntimeError(f"Whisper model {_worker_model_size} could not be loaded")
+    return _worker_processor.process_audio_chunk(y, sample_rate)
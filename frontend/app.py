@@ -1,12 +1,17 @@
 # frontend/app.py - Streamlit frontend for SOAP Note App
 import streamlit as st
 import requests
+import sseclient
+import threading
+import queue
+import hashlib
 import time
-import json
+import os
+import re
+import orjson
 from audio_recorder_streamlit import audio_recorder
-from streamlit_autorefresh import st_autorefresh
-import io
 from datetime import datetime
+from collections import Counter
 
 # Page configuration
 st.set_page_config(
@@ -19,74 +24,20 @@ st.set_page_config(
 # Backend URL
 BACKEND_URL = "http://127.0.0.1:8002"
 
+# Seconds the SSE fallback poll lets the backend hold the request (blocks the fragment, so keep it short)
+FALLBACK_POLL_WAIT = 3
+
 # Custom CSS for better UI
-st.markdown("""
-<style>
-.main-header {
-    background: linear-gradient(90deg, #667eea 0%, #764ba2 100%);
-    padding: 1rem;
-    border-radius: 10px;
-    color: white;
-    text-align: center;
-    margin-bottom: 2rem;
-}
-
-.patient-msg {
-    background: linear-gradient(135deg, #ffeef8 0%, #f8e8ff 100%);
-    color: #2d2d2d;
-    padding: 15px;
-    border-radius: 15px;
-    margin: 10px 0;
-    border-left: 5px solid #9C27B0;
-    box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-}
-
-.doctor-msg {
-    background: linear-gradient(135deg, #e3f2fd 0%, #f0f8ff 100%);
-    color: #2d2d2d;
-    padding: 15px;
-    border-radius: 15px;
-    margin: 10px 0;
-    border-left: 5px solid #2196F3;
-    box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-}
-
-.status-active {
-    background: #4CAF50;
-    color: white;
-    padding: 8px 16px;
-    border-radius: 20px;
-    font-weight: bold;
-    display: inline-block;
-}
-
-.status-inactive {
-    background: #757575;
-    color: white;
-    padding: 8px 16px;
-    border-radius: 20px;
-    font-weight: bold;
-    display: inline-block;
-}
-
-.soap-section {
-    background: #f8f9fa;
-    padding: 15px;
-    border-radius: 10px;
-    margin: 10px 0;
-    border-left: 4px solid #007bff;
-}
-
-.conversation-container {
-    max-height: 500px;
-    overflow-y: auto;
-    padding: 10px;
-    border: 1px solid #ddd;
-    border-radius: 10px;
-    background: #fafafa;
-}
-</style>
-""", unsafe_allow_html=True)
+@st.cache_resource
+def load_css() -> str:
+    """Read and minify the stylesheet once per server process"""
+    css_path = os.path.join(os.path.dirname(__file__), "app.css")
+    with open(css_path) as css_file:
+        css = re.sub(r"/\*.*?\*/", "", css_file.read(), flags=re.S)
+    css = re.sub(r"\s+", " ", css).strip()
+    return f"<style>{css}</style>"
+
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # Initialize session state
 if 'session_id' not in st.session_state:
@@ -97,22 +48,71 @@ if 'listening_mode' not in st.session_state:
     st.session_state.listening_mode = False
 if 'soap_note' not in st.session_state:
     st.session_state.soap_note = None
+if '_last_audio_hash' not in st.session_state:
+    st.session_state._last_audio_hash = None
+if 'last_seq' not in st.session_state:
+    st.session_state.last_seq = 0
+if 'conversation_etag' not in st.session_state:
+    st.session_state.conversation_etag = None
+if 'conversation_nonce' not in st.session_state:
+    st.session_state.conversation_nonce = 0
+if 'stream_events' not in st.session_state:
+    st.session_state.stream_events = None
+if 'stream_stop' not in st.session_state:
+    st.session_state.stream_stop = None
+if 'stream_thread' not in st.session_state:
+    st.session_state.stream_thread = None
 
 # Helper functions
-def call_backend(endpoint, method="GET", data=None, files=None):
+@st.cache_resource
+def _http() -> requests.Session:
+    """Pooled keep-alive HTTP session shared by all reruns (one per server process)"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = "gzip"
+    return session
+
+def _warm_connection(http):
+    """Open a pooled connection to the backend (errors are ignored - it's only a warmup)"""
+    try:
+        http.get(f"{BACKEND_URL}/", timeout=2)
+    except requests.exceptions.RequestException:
+        pass
+
+@st.cache_resource
+def _warm() -> bool:
+    """Warm the backend connection in the background, once per server process"""
+    threading.Thread(target=_warm_connection, args=(_http(),), daemon=True).start()
+    return True
+
+_warm()
+
+def _iter_bytes(data, chunk_size=64 * 1024):
+    """Yield data in bytes chunks for a streamed request body"""
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+def call_backend(endpoint, method="GET", data=None, raw=None):
     """Call backend API"""
     try:
         url = f"{BACKEND_URL}/{endpoint}"
         if method == "POST":
-            if files:
-                response = requests.post(url, files=files, timeout=30)
+            if raw is not None:
+                # Raw WAV body, streamed in chunks (chunked transfer encoding)
+                response = _http().post(url, data=_iter_bytes(raw), headers={"Content-Type": "audio/wav"}, timeout=60)
             else:
-                response = requests.post(url, json=data, timeout=30)
+                response = _http().post(
+                    url,
+                    data=orjson.dumps(data),
+                    headers={"Content-Type": "application/json"},
+                    timeout=30
+                )
         else:
-            response = requests.get(url, timeout=30)
+            response = _http().get(url, timeout=30)
         
         if response.status_code == 200:
-            return response.json()
+            return orjson.loads(response.content)
         else:
             st.error(f"Backend error: {response.status_code} - {response.text}")
             return None
@@ -120,14 +120,98 @@ def call_backend(endpoint, method="GET", data=None, files=None):
         st.error(f"Connection error: {str(e)}")
         return None
 
+def listen_for_messages(session_id, since, events, stop):
+    """Background thread: push conversation messages after `since` from the SSE stream into a queue"""
+    try:
+        response = requests.get(
+            f"{BACKEND_URL}/session/{session_id}/stream",
+            params={"since": since},
+            stream=True,
+            # identity: a gzip-buffered stream would hold events back
+            headers={"Accept": "text/event-stream", "Accept-Encoding": "identity"},
+            timeout=(5, 60)
+        )
+        for event in sseclient.SSEClient(response).events():
+            if stop.is_set():
+                break
+            events.put((int(event.id), orjson.loads(event.data)))
+        response.close()
+        # The backend closes the stream once the session ends - nothing to resume
+        stop.set()
+    except requests.exceptions.RequestException:
+        # Stream dropped - watch_conversation_stream resumes it from last_seq
+        pass
+
+def start_stream(session_id):
+    """Start the SSE listener thread for a session, resuming after last_seq"""
+    stop_stream()
+    st.session_state.stream_events = queue.Queue()
+    st.session_state.stream_stop = threading.Event()
+    st.session_state.stream_thread = threading.Thread(
+        target=listen_for_messages,
+        args=(session_id, st.session_state.last_seq,
+              st.session_state.stream_events, st.session_state.stream_stop),
+        daemon=True
+    )
+    st.session_state.stream_thread.start()
+
+def ensure_stream():
+    """Restart the SSE listener if its connection dropped while the session is still live"""
+    thread = st.session_state.stream_thread
+    stop = st.session_state.stream_stop
+    if thread is not None and not thread.is_alive() and stop is not None and not stop.is_set():
+        # Reconnect from the client cursor (callers drain the old queue first)
+        start_stream(st.session_state.session_id)
+
+def stop_stream():
+    """Signal the SSE listener thread (if any) to stop"""
+    if st.session_state.stream_stop is not None:
+        st.session_state.stream_stop.set()
+    st.session_state.stream_events = None
+    st.session_state.stream_stop = None
+    st.session_state.stream_thread = None
+
+def drain_stream_events():
+    """Append streamed messages to the conversation; True if anything new arrived"""
+    events = st.session_state.stream_events
+    if events is None:
+        return False
+    
+    added = False
+    while True:
+        try:
+            seq, message = events.get_nowait()
+        except queue.Empty:
+            break
+        
+        if seq > st.session_state.last_seq + 1:
+            # Missed some messages - fetch the gap
+            added = get_conversation(fresh=True) or added
+        if seq == st.session_state.last_seq + 1:
+            added = merge_messages([message]) or added
+    return added
+
+def merge_messages(messages):
+    """Append messages newer than last_seq; True if any were added"""
+    added = False
+    for message in messages:
+        if message["seq"] > st.session_state.last_seq:
+            st.session_state.conversation.append(message)
+            st.session_state.last_seq = message["seq"]
+            added = True
+    return added
+
 def start_session():
     """Start a new conversation session"""
     result = call_backend("session/start", "POST", {})
     if result and result.get('success'):
         st.session_state.session_id = result['data']['session_id']
         st.session_state.conversation = []
+        st.session_state.last_seq = 0
+        st.session_state.conversation_etag = None
         st.session_state.listening_mode = True
         st.session_state.soap_note = None
+        start_stream(st.session_state.session_id)
         return True
     return False
 
@@ -137,6 +221,7 @@ def stop_session():
         result = call_backend("session/stop", "POST", {"session_id": st.session_state.session_id})
         if result and result.get('success'):
             st.session_state.listening_mode = False
+            stop_stream()
             return True
     return False
 
@@ -145,23 +230,71 @@ def process_audio(audio_bytes):
     if not st.session_state.session_id:
         return False
     
-    files = {"audio": ("audio.wav", io.BytesIO(audio_bytes), "audio/wav")}
-    result = call_backend(f"voice/process?session_id={st.session_state.session_id}", "POST", files=files)
+    result = call_backend(f"voice/process?session_id={st.session_state.session_id}", "POST", raw=audio_bytes)
     
     if result and result.get('success'):
-        # Refresh conversation
-        get_conversation()
+        # The session changed - bust this browser session's cached deltas
+        st.session_state.conversation_nonce += 1
+        
+        # The response carries the stored message - only refetch if we missed others
+        message = result['data']['message']
+        if message['seq'] > st.session_state.last_seq + 1:
+            get_conversation(fresh=True)
+        else:
+            merge_messages([message])
         return True
     return False
 
-def get_conversation():
-    """Get current conversation from backend"""
+def get_conversation(wait=0, fresh=False):
+    """
+    Fetch messages newer than last_seq from the backend and append them
+    With wait > 0 the backend holds the request until a new message arrives
+    fresh=True bypasses the short-lived delta cache (gap fills, manual refresh, long polls)
+    """
     if not st.session_state.session_id:
-        return
+        return False
     
-    result = call_backend(f"session/{st.session_state.session_id}/conversation")
-    if result and result.get('success'):
-        st.session_state.conversation = result['data']['messages']
+    try:
+        if fresh:
+            messages, etag = _fetch_conversation(
+                st.session_state.session_id, st.session_state.last_seq, wait,
+                st.session_state.conversation_etag
+            )
+        else:
+            messages, etag = _cached_conversation(
+                st.session_state.session_id, st.session_state.last_seq, wait,
+                st.session_state.conversation_etag, st.session_state.conversation_nonce
+            )
+    except requests.exceptions.RequestException as e:
+        st.error(f"Connection error: {str(e)}")
+        return False
+    st.session_state.conversation_etag = etag
+    return merge_messages(messages)
+
+def _fetch_conversation(session_id, since, wait, etag=None):
+    """
+    Messages after `since` for a session, straight from the backend; failures raise
+    Returns: (messages, etag) - no messages when the backend answers 304 to etag
+    """
+    response = _http().get(
+        f"{BACKEND_URL}/session/{session_id}/conversation",
+        params={"since": since, "wait": wait},
+        headers={"If-None-Match": etag} if etag else None,
+        timeout=30 + wait
+    )
+    if response.status_code == 304:
+        return [], etag
+    response.raise_for_status()
+    return orjson.loads(response.content)['data']['messages'], response.headers.get("ETag")
+
+@st.cache_data(ttl=2, show_spinner=False)
+def _cached_conversation(session_id, since, wait, etag, nonce):
+    """
+    _fetch_conversation shared by reruns within 2 seconds
+    nonce is per browser session; bumping it busts only that session's entries
+    Failures raise (and so are never cached)
+    """
+    return _fetch_conversation(session_id, since, wait, etag)
 
 def generate_soap_note(patient_name="Unknown Patient"):
     """Generate SOAP note from conversation"""
@@ -178,6 +311,65 @@ def generate_soap_note(patient_name="Unknown Patient"):
         return True
     return False
 
+# Message templates, formatted per message by render_conversation
+_DOCTOR_TMPL = (
+    '<div class="doctor-msg">'
+    '<strong style="color: #1976D2;">👨‍⚕️ Doctor [{ts}]</strong>'
+    '<span style="float: right; font-size: 0.8em; color: #666;">Confidence: {conf:.1%}</span><br>'
+    '{text}</div>'
+)
+_PATIENT_TMPL = (
+    '<div class="patient-msg">'
+    '<strong style="color: #7B1FA2;">🤒 Patient [{ts}]</strong>'
+    '<span style="float: right; font-size: 0.8em; color: #666;">Confidence: {conf:.1%}</span><br>'
+    '{text}</div>'
+)
+_TMPL = {"Doctor": _DOCTOR_TMPL, "Patient": _PATIENT_TMPL}
+
+@st.cache_data(ttl=60)
+def render_conversation(messages):
+    """Render (speaker, text, timestamp, confidence) tuples into one HTML block"""
+    html_parts = ['<div class="conversation-container">']
+    html_parts.extend(
+        _TMPL.get(speaker, _PATIENT_TMPL).format(ts=timestamp, conf=confidence, text=text)
+        for speaker, text, timestamp, confidence in messages
+    )
+    html_parts.append('</div>')
+    return "".join(html_parts)
+
+@st.cache_data
+def soap_download(soap):
+    """Build the downloadable text and file name once per generated SOAP note"""
+    soap_text = f"""
+SOAP NOTE
+Patient: {soap.get('patient_name', 'Unknown')}
+Date: {soap.get('date', 'N/A')}
+
+S - SUBJECTIVE:
+{soap.get('subjective', '')}
+
+O - OBJECTIVE:
+{soap.get('objective', '')}
+
+A - ASSESSMENT:
+{soap.get('assessment', '')}
+
+P - PLAN:
+{soap.get('plan', '')}
+
+Generated: {soap.get('generated_at', 'N/A')}
+Confidence: {soap.get('confidence_score', 0):.1%}
+            """
+    file_name = f"soap_note_{soap.get('patient_name', 'patient').replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    return soap_text, file_name
+
+def throttled_rerun(min_interval=0.5):
+    """st.rerun(), but at most once per min_interval seconds to coalesce bursts"""
+    now = time.monotonic()
+    if now - st.session_state.get("_last_rerun", 0) > min_interval:
+        st.session_state._last_rerun = now
+        st.rerun()
+
 # Main UI
 st.markdown("""
 <div class="main-header">
@@ -186,9 +378,21 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Auto-refresh for real-time updates
+# Real-time updates: pick up streamed messages and rerun only when something arrived
+@st.fragment(run_every=1)
+def watch_conversation_stream():
+    added = drain_stream_events()
+    thread = st.session_state.stream_thread
+    if thread is None or not thread.is_alive():
+        # Stream is down - long-poll for the delta, uncached so a timed-out empty
+        # result isn't replayed (a 304 when nothing changed)
+        added = get_conversation(wait=FALLBACK_POLL_WAIT, fresh=True) or added
+    ensure_stream()
+    if added:
+        st.rerun()
+
 if st.session_state.listening_mode:
-    st_autorefresh(interval=3000, key="conversation_refresh")
+    watch_conversation_stream()
 
 # Main layout
 col1, col2 = st.columns([1, 1])
@@ -232,58 +436,42 @@ with col1:
             neutral_color="#4CAF50",
             icon_name="microphone",
             icon_size="2x",
-            key=f"voice_recorder_{len(st.session_state.conversation)}"
+            key="voice_recorder"
         )
         
-        if audio_bytes:
+        # The recorder keeps returning its last clip on every rerun - process each clip once
+        audio_hash = hashlib.blake2b(audio_bytes, digest_size=8).digest() if audio_bytes else None
+        if audio_hash and audio_hash != st.session_state._last_audio_hash:
+            st.session_state._last_audio_hash = audio_hash
             with st.spinner("🎧 Processing voice..."):
                 if process_audio(audio_bytes):
                     st.success("✅ Voice processed!")
-                    st.rerun()
+                    throttled_rerun()
                 else:
                     st.error("❌ Failed to process voice")
     
     # Manual refresh button
     if st.session_state.session_id:
         if st.button("🔄 Refresh Conversation", use_container_width=True):
-            get_conversation()
+            get_conversation(fresh=True)
             st.rerun()
 
 with col2:
     st.subheader("💬 Live Conversation")
     
     if st.session_state.conversation:
-        # Display conversation in scrollable container
-        st.markdown('<div class="conversation-container">', unsafe_allow_html=True)
-        
-        for msg in st.session_state.conversation:
-            speaker_emoji = "👨‍⚕️" if msg["speaker"] == "Doctor" else "🤒"
-            timestamp = msg.get("timestamp", "")
-            confidence = msg.get("confidence", 0)
-            
-            if msg["speaker"] == "Doctor":
-                st.markdown(f"""
-                <div class="doctor-msg">
-                    <strong style="color: #1976D2;">{speaker_emoji} Doctor [{timestamp}]</strong>
-                    <span style="float: right; font-size: 0.8em; color: #666;">Confidence: {confidence:.1%}</span><br>
-                    {msg['text']}
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown(f"""
-                <div class="patient-msg">
-                    <strong style="color: #7B1FA2;">{speaker_emoji} Patient [{timestamp}]</strong>
-                    <span style="float: right; font-size: 0.8em; color: #666;">Confidence: {confidence:.1%}</span><br>
-                    {msg['text']}
-                </div>
-                """, unsafe_allow_html=True)
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+        # Display conversation in scrollable container (one markdown call for all messages)
+        conversation_key = tuple(
+            (msg["speaker"], msg["text"], msg.get("timestamp", ""), msg.get("confidence") or 0)
+            for msg in st.session_state.conversation
+        )
+        st.markdown(render_conversation(conversation_key), unsafe_allow_html=True)
         
         # Show conversation stats
-        total_messages = len(st.session_state.conversation)
-        doctor_messages = len([m for m in st.session_state.conversation if m["speaker"] == "Doctor"])
-        patient_messages = len([m for m in st.session_state.conversation if m["speaker"] == "Patient"])
+        speaker_counts = Counter(speaker for speaker, *_ in conversation_key)
+        total_messages = len(conversation_key)
+        doctor_messages = speaker_counts["Doctor"]
+        patient_messages = speaker_counts["Patient"]
         
         st.markdown(f"""
         **📊 Conversation Stats:**
@@ -339,31 +527,12 @@ if st.session_state.conversation:
                 """, unsafe_allow_html=True)
             
             # Download option
-            soap_text = f"""
-SOAP NOTE
-Patient: {soap.get('patient_name', 'Unknown')}
-Date: {soap.get('date', 'N/A')}
-
-S - SUBJECTIVE:
-{soap.get('subjective', '')}
-
-O - OBJECTIVE:
-{soap.get('objective', '')}
-
-A - ASSESSMENT:
-{soap.get('assessment', '')}
-
-P - PLAN:
-{soap.get('plan', '')}
-
-Generated: {soap.get('generated_at', 'N/A')}
-Confidence: {soap.get('confidence_score', 0):.1%}
-            """
+            soap_text, soap_file_name = soap_download(soap)
             
             st.download_button(
                 label="📄 Download SOAP Note",
                 data=soap_text,
-                file_name=f"soap_note_{soap.get('patient_name', 'patient').replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                file_name=soap_file_name,
                 mime="text/plain",
                 use_container_width=True
             )
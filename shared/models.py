@@ -1,14 +1,17 @@
 # shared/models.py - Shared data models for SOAP Note App
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 from datetime import datetime
 
 class ConversationMessage(BaseModel):
     """Single message in conversation"""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+    
     speaker: str  # "Doctor" or "Patient"
     text: str
     timestamp: str
     confidence: Optional[float] = None  # Speaker detection confidence
+    seq: int = 0  # 1-based position in the session, assigned by the backend
 
 class ConversationSession(BaseModel):
     """Complete conversation session"""
@@ -20,6 +23,8 @@ class ConversationSession(BaseModel):
 
 class SOAPNote(BaseModel):
     """SOAP Note structure"""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+    
     patient_name: Optional[str] = "Unknown Patient"
     date: str
     age_gender: Optional[str] = None
@@ -1,24 +1,32 @@
 # start_backend.py - Start the FastAPI backend server
-import subprocess
-import sys
 import os
+import uvicorn
 
 def start_backend():
     """Start the FastAPI backend server"""
     print("🚀 Starting SOAP Note App Backend...")
     
-    # Change to backend directory
-    backend_dir = os.path.join(os.path.dirname(__file__), 'backend')
+    # Backend directory (added to the import path for "main:app")
+    backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
+    
+    # DEV=1 enables auto-reload. Sessions live in process memory,
+    # so keep a single worker unless BACKEND_WORKERS says otherwise.
+    dev_mode = bool(os.getenv("DEV"))
+    workers = 1 if dev_mode else int(os.getenv("BACKEND_WORKERS", "1"))
     
     try:
-        # Start uvicorn server
-        subprocess.run([
-            sys.executable, "-m", "uvicorn",
+        uvicorn.run(
             "main:app",
-            "--host", "127.0.0.1",
-            "--port", "8002",
-            "--reload"
-        ], cwd=backend_dir)
+            host="127.0.0.1",
+            port=8002,
+            app_dir=backend_dir,
+            reload=dev_mode,
+            reload_dirs=[backend_dir] if dev_mode else None,
+            workers=workers,
+            loop="uvloop",
+            http="httptools",
+            log_level="info" if dev_mode else "warning"
+        )
     except KeyboardInterrupt:
         print("\n🛑 Backend server stopped")
     except Exception as e:
@@ -16,7 +16,9 @@ def start_frontend():
             sys.executable, "-m", "streamlit", "run", 
             "app.py", 
             "--server.port", "8501",
-            "--server.address", "0.0.0.0"
+            "--server.address", "0.0.0.0",
+            "--server.websocketPingInterval", "30",
+            "--server.enableWebsocketCompression", "false"
         ], cwd=frontend_dir)
     except KeyboardInterrupt:
         print("\n🛑 Frontend server stopped")
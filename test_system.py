@@ -1,18 +1,23 @@
 # test_system.py - Test the complete SOAP Note App system
 import requests
+import orjson
 import time
-import json
 from datetime import datetime
 
 # Configuration
 BACKEND_URL = "http://127.0.0.1:8002"
 
+# One keep-alive session for every call
+S = requests.Session()
+S.headers["Accept-Encoding"] = "gzip"
+S.headers["Connection"] = "keep-alive"
+
 def test_backend_health():
     """Test if backend is running"""
     try:
-        response = requests.get(f"{BACKEND_URL}/", timeout=5)
+        response = S.get(f"{BACKEND_URL}/", timeout=5)
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             print("✅ Backend is healthy!")
             print(f"   Status: {data.get('data', {}).get('status', 'unknown')}")
             return True
@@ -30,12 +35,12 @@ def test_session_workflow():
     
     # 1. Start session
     print("1️⃣ Starting new session...")
-    response = requests.post(f"{BACKEND_URL}/session/start", json={})
+    response = S.post(f"{BACKEND_URL}/session/start", json={})
     if response.status_code != 200:
         print(f"❌ Failed to start session: {response.status_code}")
         return False
     
-    session_data = response.json()
+    session_data = orjson.loads(response.content)
     session_id = session_data['data']['session_id']
     print(f"✅ Session started: {session_id}")
     
@@ -52,22 +57,22 @@ def test_session_workflow():
         {"speaker": "Doctor", "text": "Based on your symptoms, this sounds like gastritis. I'll prescribe medication", "timestamp": "10:01:20"}
     ]
     
-    # Add messages to session (simulating voice processing)
-    for msg in mock_messages:
-        response = requests.post(f"{BACKEND_URL}/add_to_conversation", json={
-            "speaker": msg["speaker"],
-            "text": msg["text"]
-        })
-        if response.status_code == 200:
+    # Add messages to session in one request (simulating voice processing)
+    response = S.post(f"{BACKEND_URL}/add_to_conversation/bulk", json={
+        "session_id": session_id,
+        "messages": mock_messages
+    })
+    if response.status_code == 200:
+        for msg in mock_messages:
             print(f"   ✅ Added: {msg['speaker']} - {msg['text'][:30]}...")
-        else:
-            print(f"   ❌ Failed to add message: {response.status_code}")
+    else:
+        print(f"   ❌ Failed to add messages: {response.status_code}")
     
     # 3. Get conversation
     print("3️⃣ Retrieving conversation...")
-    response = requests.get(f"{BACKEND_URL}/session/{session_id}/conversation")
+    response = S.get(f"{BACKEND_URL}/session/{session_id}/conversation")
     if response.status_code == 200:
-        conv_data = response.json()
+        conv_data = orjson.loads(response.content)
         message_count = conv_data['data']['message_count']
         print(f"✅ Retrieved conversation with {message_count} messages")
     else:
@@ -76,13 +81,13 @@ def test_session_workflow():
     
     # 4. Generate SOAP note
     print("4️⃣ Generating SOAP note...")
-    response = requests.post(f"{BACKEND_URL}/soap/generate", json={
+    response = S.post(f"{BACKEND_URL}/soap/generate", json={
         "session_id": session_id,
         "patient_name": "John Doe"
     })
     
     if response.status_code == 200:
-        soap_data = response.json()
+        soap_data = orjson.loads(response.content)
         soap_note = soap_data['data']
         print("✅ SOAP note generated successfully!")
         print(f"   Patient: {soap_note.get('patient_name')}")
@@ -105,7 +110,7 @@ def test_session_workflow():
     
     # 5. Stop session
     print("5️⃣ Stopping session...")
-    response = requests.post(f"{BACKEND_URL}/session/stop", json={"session_id": session_id})
+    response = S.post(f"{BACKEND_URL}/session/stop", json={"session_id": session_id})
     if response.status_code == 200:
         print("✅ Session stopped successfully!")
     else:
@@ -113,12 +118,36 @@ def test_session_workflow():
     
     return True
 
+def test_invalid_audio():
+    """Test that an undecodable upload is reported as no speech, not a server error"""
+    print("\n🧪 Testing Invalid Audio...")
+    response = S.post(f"{BACKEND_URL}/session/start", json={})
+    if response.status_code != 200:
+        print(f"❌ Failed to start session: {response.status_code}")
+        return False
+    session_id = orjson.loads(response.content)['data']['session_id']
+    
+    response = S.post(
+        f"{BACKEND_URL}/voice/process",
+        params={"session_id": session_id},
+        data=b"this is not a wav file",
+        headers={"Content-Type": "audio/wav"}
+    )
+    S.post(f"{BACKEND_URL}/session/stop", json={"session_id": session_id})
+    
+    if response.status_code == 200 and not orjson.loads(response.content)['success']:
+        print("✅ Invalid audio rejected without a server error")
+        return True
+    else:
+        print(f"❌ Unexpected response to invalid audio: {response.status_code}")
+        return False
+
 def test_active_sessions():
     """Test active sessions endpoint"""
     print("\n🧪 Testing Active Sessions...")
-    response = requests.get(f"{BACKEND_URL}/sessions/active")
+    response = S.get(f"{BACKEND_URL}/sessions/active")
     if response.status_code == 200:
-        data = response.json()
+        data = orjson.loads(response.content)
         session_count = data['data']['count']
         print(f"✅ Active sessions retrieved: {session_count} sessions")
         return True
@@ -126,28 +155,41 @@ def test_active_sessions():
         print(f"❌ Failed to get active sessions: {response.status_code}")
         return False
 
+def timed(step, func):
+    """Run one test step and report how long it took"""
+    start = time.perf_counter()
+    result = func()
+    print(f"   ⏱️ {step}: {(time.perf_counter() - start) * 1000:.0f} ms")
+    return result
+
 def main():
     """Run all tests"""
     print("🧪 SOAP Note App System Test")
     print("=" * 40)
+    total_start = time.perf_counter()
     
     # Test backend health
-    if not test_backend_health():
+    if not timed("health check", test_backend_health):
         print("\n❌ Backend is not running. Please start it first:")
         print("   python start_backend.py")
         return
     
     # Test session workflow
-    if not test_session_workflow():
+    if not timed("session workflow", test_session_workflow):
         print("\n❌ Session workflow test failed")
         return
     
+    # Test invalid audio upload
+    if not timed("invalid audio", test_invalid_audio):
+        print("\n❌ Invalid audio test failed")
+        return
+    
     # Test active sessions
-    if not test_active_sessions():
+    if not timed("active sessions", test_active_sessions):
         print("\n❌ Active sessions test failed")
         return
     
-    print("\n🎉 All tests passed successfully!")
+    print(f"\n🎉 All tests passed successfully! ({time.perf_counter() - total_start:.2f} s)")
     print("\n📋 System is ready for use:")
     print("1. Backend is running on: http://localhost:8001")
     print("2. Start frontend: python start_frontend.py")